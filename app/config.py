@@ -8,4 +8,17 @@ class Config:
     AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY")
     AWS_SECRET_KEY = os.getenv("AWS_SECRET_KEY")
     AWS_BUCKET_NAME = os.getenv("AWS_BUCKET_NAME")
-    VECTOR_DB_PATH = "doc_int_vector_db"
\ No newline at end of file
+    AWS_VECTOR_BUCKET_NAME = os.getenv("AWS_VECTOR_BUCKET_NAME")
+    AWS_VECTOR_INDEX_NAME = os.getenv("AWS_VECTOR_INDEX_NAME")
+    VECTOR_DB_PATH = "doc_int_vector_db"
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+    EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "openai")
+    JINA_API_KEY = os.getenv("JINA_API_KEY")
+    ONNX_MODEL_ID = os.getenv("ONNX_MODEL_ID", "sentence-transformers/multi-qa-distilbert-cos-v1")
+    ONNX_MODEL_FILE = os.getenv("ONNX_MODEL_FILE", "model_qint8_avx512.onnx")
+    BINARY_INDEX = os.getenv("BINARY_INDEX", "false").lower() == "true"
+    DEBUG = os.getenv("FLASK_DEBUG", "false").lower() == "true"
+    SERVER_THREADS = int(os.getenv("SERVER_THREADS", "16"))
+    MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "50"))
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+    MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "20"))
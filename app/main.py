@@ -4,24 +4,40 @@ from models.vector_store import VectorStore
 from services.storage_service import S3Storage
 # Import LLMService to generate responses using OpenAI's GPT model
 from services.llm_service import LLMService
+# Import JobQueue to run document ingestion in the background
+from services.job_service import JobQueue
 # Import Config to access environment variables and configuration settings
 from config import Config
 # Import os for file system operations like path handling and file removal
 import os 
-# Import document loaders from LangChain Community for reading PDF and text files
-from langchain_community.document_loaders import TextLoader, PyPDFLoader 
+# Import TextLoader from LangChain Community for reading plain text files
+from langchain_community.document_loaders import TextLoader
+# Import pymupdf to read PDF files page by page with the C-based MuPDF parser
+import pymupdf
+# Import Document to wrap each parsed PDF page in LangChain's document type
+from langchain_core.documents import Document
 # Import RecursiveCharacterTextSplitter from the text_splitters package
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+# Import bisect to map chunk offsets back to the page they start on
+import bisect
+# Import itertools to put the first parsed batch back in front of the rest of the document
+import itertools
+# Import contextlib to close the page iterator as soon as a document is done or abandoned
+import contextlib
 # Import tempfile to create temporary directories for processing uploaded files
 import tempfile
 # Import logging for tracking application events and debugging
 import logging
 # Import Flask components to build the web API and handle HTTP requests
 from flask import Flask, request, render_template, jsonify
+# Import RequestEntityTooLarge so oversized uploads reach the 413 handler
+from werkzeug.exceptions import RequestEntityTooLarge
 
 
 # Create a Flask application instance - the main web server for handling HTTP requests
 app = Flask(__name__)
+# Reject request bodies over the upload limit before they are read
+app.config['MAX_CONTENT_LENGTH'] = Config.MAX_UPLOAD_MB * 1024 * 1024
 
 
 # Initialize VectorStore with the configured database path for storing document embeddings
@@ -31,6 +47,8 @@ vector_store = VectorStore(Config.VECTOR_DB_PATH)
 storage_service = S3Storage()
 # Initialize LLMService with the vector store to enable question-answering based on documents
 llm_service = LLMService(vector_store)
+# Initialize JobQueue so uploads are parsed, archived and embedded off the request thread
+job_queue = JobQueue(max_workers=Config.INGEST_WORKERS)
 
 
 # Define the root route that serves the main web interface
@@ -39,6 +57,24 @@ def index():
     # Return the index.html template to display the UI in the browser
     return render_template('index.html')
 
+# Text splitter shared by every upload - it is stateless, so one instance is built at startup
+# Large documents can cause issues with embeddings, so we break them into overlapping pieces
+_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=1000,  # Each chunk is max 1000 characters
+    chunk_overlap=200,  # Overlap of 200 chars to maintain context between chunks
+    length_function=len,
+    is_separator_regex=False
+)
+# Number of parsed pages split together and handed to the embedder as one batch
+_PAGES_PER_BATCH = 8
+# Splitter for late chunking - chunks are embedded in the context of the whole document,
+# so they don't need overlapping text, and start_index records each chunk's character offset
+_LATE_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=1000,
+    chunk_overlap=0,
+    add_start_index=True
+)
+
 # Configure logging to track application events, errors, and debug information
 # DEBUG level shows all log messages from lowest to highest severity
 logging.basicConfig(level=logging.DEBUG)
@@ -46,81 +82,215 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
-# Helper function to process uploaded documents into text chunks
-def process_document(file):
+# Helper function to save an uploaded file to a temporary location for background processing
+def save_upload(file):
     """
-    Process document based on file type and return text chunks for embedding.
+    Save an uploaded file to its own temporary directory.
     
-    Supports:
-    - PDF files: Extracted using PyPDFLoader
-    - TXT files: Loaded using TextLoader
+    The Werkzeug file object is only valid during the request, so the
+    background ingestion job works from this copy instead.
     
     Args:
         file: The uploaded file object from Flask request
         
     Returns:
-        List of LangChain Document objects split into manageable chunks
-        
-    Raises:
-        ValueError: If file type is not supported (not .pdf or .txt)
+        Path of the saved temporary file
     """
     # Create a temporary directory to store the file during processing
-    # This directory will be cleaned up after processing is complete
+    # This directory is removed by ingest_document once processing is complete
     temp_dir = tempfile.mkdtemp()
     # Create the full path for the temporary file (directory + filename)
     temp_path = os.path.join(temp_dir, file.filename)
+    # Save the uploaded file to the temporary location
+    # This is necessary because loaders need a file path, not a file object
+    file.save(temp_path)
+    return temp_path
+
+
+# Helper function to read a saved document one page at a time, based on its extension
+def _iter_pages(temp_path, filename):
+    # Process the file based on its extension to extract content
+    if filename.endswith('.pdf'):
+        # Open PDF files with PyMuPDF directly - the C-based MuPDF parser is much faster than pypdf
+        # LangChain's PyMuPDFLoader holds a process-wide lock for its whole page loop, which would
+        # serialize every PDF ingest while this generator is suspended between batches
+        # The with block closes the file once all pages are read or the generator is closed
+        with pymupdf.open(temp_path) as pdf:
+            for number, page in enumerate(pdf):
+                yield Document(
+                    page_content=page.get_text(),
+                    metadata={'source': temp_path, 'file_path': temp_path,
+                              'page': number, 'total_pages': pdf.page_count}
+                )
+    elif filename.endswith('.txt'):
+        # Use TextLoader for plain text files
+        yield from TextLoader(temp_path).lazy_load()
+    else:
+        # Raise error if file type is not supported
+        raise ValueError("Unsupported file type")
+
+
+# Helper function to process saved documents into text chunks, a few pages at a time
+def process_document(temp_path, filename):
+    """
+    Process document based on file type and yield text chunks for embedding.
     
-    try:
-        # Save the uploaded file to the temporary location
-        # This is necessary because loaders need a file path, not a file object
-        file.save(temp_path)
+    Supports:
+    - PDF files: Extracted page by page using PyMuPDF
+    - TXT files: Loaded using TextLoader
+    
+    Args:
+        temp_path: Path of the saved document on local disk
+        filename: Original name of the uploaded file
         
-        # Process the file based on its extension to extract content
-        if file.filename.endswith('.pdf'):
-            # Use PyPDFLoader for PDF files - extracts text from all pages
-            loader = PyPDFLoader(temp_path)
-            documents = loader.load()
-        elif file.filename.endswith('.txt'):
-            # Use TextLoader for plain text files
-            loader = TextLoader(temp_path)
-            documents = loader.load()
-        else:
-            # Raise error if file type is not supported
-            raise ValueError("Unsupported file type")
-
-        # Split documents into smaller chunks for better embedding and retrieval
-        # Large documents can cause issues with embeddings, so we break them into pieces
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,  # Each chunk is max 1000 characters
-            chunk_overlap=200  # Overlap of 200 chars to maintain context between chunks
-        )
-        # Apply the splitter to break documents into overlapping chunks
-        text_chunks = text_splitter.split_documents(documents)
+    Yields:
+        Lists of LangChain Document objects split into manageable chunks,
+        one list per _PAGES_PER_BATCH pages
+        
+    Raises:
+        ValueError: If file type is not supported (not .pdf or .txt)
+    """
+    # Pages are parsed lazily and split in small groups, so peak memory
+    # depends on _PAGES_PER_BATCH pages rather than on the size of the document
+    # closing() releases the open file as soon as this generator is closed, even part-way through
+    with contextlib.closing(_iter_pages(temp_path, filename)) as page_iter:
+        pages = []
+        for page in page_iter:
+            pages.append(page)
+            if len(pages) >= _PAGES_PER_BATCH:
+                yield _SPLITTER.split_documents(pages)
+                pages = []
+        if pages:
+            yield _SPLITTER.split_documents(pages)
+
+
+# Helper function to process saved documents into chunk offsets for late chunking
+def process_document_spans(temp_path, filename):
+    """
+    Process document into its full text and the character offsets of its chunks.
+    
+    Used with late chunking, where the embeddings backend embeds the whole
+    document once and pools a vector for each chunk.
+    
+    Args:
+        temp_path: Path of the saved document on local disk
+        filename: Original name of the uploaded file
         
-        # Return the processed text chunks ready for embedding
-        return text_chunks
+    Returns:
+        Tuple of (full_text, spans, metadatas) - spans are non-overlapping
+        (start, end) offsets into full_text, metadatas has one dict per span
         
+    Raises:
+        ValueError: If file type is not supported (not .pdf or .txt)
+    """
+    pages = list(_iter_pages(temp_path, filename))
+    # Join the pages into one document and remember where each page starts
+    page_starts = []
+    offset = 0
+    for page in pages:
+        page_starts.append(offset)
+        offset += len(page.page_content) + 1
+    full_text = "\n".join(page.page_content for page in pages)
+
+    spans = []
+    metadatas = []
+    for chunk in _LATE_SPLITTER.create_documents([full_text]):
+        start = chunk.metadata['start_index']
+        spans.append((start, start + len(chunk.page_content)))
+        # Each chunk keeps the metadata (source, page, ...) of the page it starts on
+        page = pages[bisect.bisect_right(page_starts, start) - 1]
+        metadatas.append(dict(page.metadata))
+
+    return full_text, spans, metadatas
+
+
+# Background job that runs the full ingestion pipeline for one uploaded file
+def ingest_document(temp_path, filename):
+    """
+    Parse a saved upload, archive it on S3 and add its chunks to the vector store.
+    
+    Runs on a JobQueue worker thread so the upload request can return immediately.
+    
+    Args:
+        temp_path: Path of the saved document on local disk
+        filename: Original name of the uploaded file
+        
+    Returns:
+        Dictionary with the number of chunks processed
+    """
+    # Page batch generator for the streaming path, closed in the finally block below
+    batches = None
+    # Whether the original file reached S3, so a later failure knows to remove it again
+    uploaded = False
+    try:
+        # Process the document: extract content and split into chunks
+        # The Jina backend embeds whole documents, so it only needs each chunk's offsets
+        # Other backends stream chunks straight into the vector store below
+        if Config.EMBEDDINGS_BACKEND == "jina":
+            full_text, spans, metadatas = process_document_spans(temp_path, filename)
+            logger.debug(f"{filename} processed into {len(spans)} chunks")
+        else:
+            # Parse the first pages before archiving, so unsupported or unreadable files fail
+            # without leaving an orphaned copy on S3
+            batches = process_document(temp_path, filename)
+            first_batch = next(batches, [])
+
+        # Upload the original file to S3 for long-term storage and archival
+        # The saved temp file is uploaded directly, so the upload stream is never re-read
+        # upload_file reports failures by returning False - fail the job rather than silently skip the archive
+        if not storage_service.upload_file(temp_path, filename):
+            raise RuntimeError(f"Error uploading {filename} to S3")
+        uploaded = True
+        logger.debug(f"{filename} uploaded to S3")
+
+        # Add the processed text chunks to the vector store for semantic search
+        # This allows users to query the document content using natural language
+        if Config.EMBEDDINGS_BACKEND == "jina":
+            vector_store.add_documents_late(full_text, spans, metadatas)
+            chunk_count = len(spans)
+        else:
+            # The remaining pages are parsed on a background thread and embedded as each batch is ready
+            # If embedding fails part-way, the chunks already written are removed again
+            chunk_count = vector_store.add_documents_stream(itertools.chain([first_batch], batches))
+        logger.debug(f"{filename} added to vector store as {chunk_count} chunks")
+
+        return {'chunks_processed': chunk_count}
+
+    except Exception:
+        # The vector store rolls back its chunks on failure - remove the archived copy too,
+        # so S3 never keeps a document that can't be searched
+        if uploaded:
+            storage_service.delete_file(filename)
+        raise
+
     finally:
+        # Close the parser if the job failed part-way, so the PDF is no longer open when it is removed
+        if batches is not None:
+            batches.close()
+        # The temp file is the only copy read by the parser and the S3 upload,
+        # so it is removed only after both the S3 and vector store writes have finished
         # Clean up temporary files regardless of success or failure
         # This ensures no temporary files are left behind on disk
         if os.path.exists(temp_path):
             os.remove(temp_path)
-        os.rmdir(temp_dir)
+        os.rmdir(os.path.dirname(temp_path))
 
 # Define the API endpoint for uploading and processing documents
 @app.route('/upload', methods=['POST'])
 def upload_document():
     """
-    Handle document upload, process it, store on S3, and add to vector database.
+    Handle document upload and queue it for background processing.
     
     This endpoint:
-    1. Validates the uploaded file
-    2. Processes the document into chunks
-    3. Uploads the original file to S3
-    4. Stores the chunks in the vector database for semantic search
+    1. Validates the uploaded file(s)
+    2. Saves each file to a temporary location
+    3. Queues a background job per file that processes the document,
+       uploads the original to S3 and stores the chunks in the vector database
+    
+    Use the /status/<job_id> endpoint to follow each job.
     
     Returns:
-        JSON response with success message or error details
+        202 JSON response with one job id per file, or error details
     """
     try:
         # Log the endpoint call for debugging and monitoring
@@ -132,67 +302,69 @@ def upload_document():
             # Return 400 Bad Request error if no file is provided
             return jsonify({'error': 'No file provided'}), 400
         
-        # Get the file from the request
-        file = request.files['file']
-        # Check if the filename is empty (user selected but didn't choose a file)
-        if file.filename == '':
-            logger.warning("Empty filename")
-            # Return 400 Bad Request error if filename is empty
-            return jsonify({'error': 'No file selected'}), 400
-
-        # Validate that the file has a supported extension (.txt or .pdf)
-        if not file.filename.endswith(('.txt', '.pdf')):
-            logger.warning(f"Unsupported file type: {file.filename}")
-            # Return 400 Bad Request error for unsupported file types
-            return jsonify({'error': 'Only .txt and .pdf files are supported'}), 400
-
-        # Log the file being processed
-        logger.debug(f"Processing file: {file.filename}")
-        
-        # Process the document: extract content and split into chunks
-        try:
-            text_chunks = process_document(file)
-            logger.debug(f"Document processed into {len(text_chunks)} chunks")
-        except Exception as e:
-            # Log any errors that occur during document processing
-            logger.error(f"Error processing document: {str(e)}")
-            # Return 500 Internal Server Error if processing fails
-            return jsonify({'error': f'Error processing document: {str(e)}'}), 500
+        # Get every file from the request - the UI can send several at once
+        files = request.files.getlist('file')
+        for file in files:
+            # Check if the filename is empty (user selected but didn't choose a file)
+            if file.filename == '':
+                logger.warning("Empty filename")
+                # Return 400 Bad Request error if filename is empty
+                return jsonify({'error': 'No file selected'}), 400
 
-        # Upload the original file to S3 for long-term storage and archival
-        try:
-            file.seek(0)  # Reset file pointer to beginning for re-reading
-            storage_service.upload_file(file, file.filename)
-            logger.debug("File uploaded to S3")
-        except Exception as e:
-            # Log any S3 upload errors
-            logger.error(f"Error uploading to S3: {str(e)}")
-            # Return 500 Internal Server Error if S3 upload fails
-            return jsonify({'error': f'Error uploading to S3: {str(e)}'}), 500
+            # Validate that the file has a supported extension (.txt or .pdf)
+            if not file.filename.endswith(('.txt', '.pdf')):
+                logger.warning(f"Unsupported file type: {file.filename}")
+                # Return 400 Bad Request error for unsupported file types
+                return jsonify({'error': 'Only .txt and .pdf files are supported'}), 400
 
-        # Add the processed text chunks to the vector store for semantic search
-        # This allows users to query the document content using natural language
-        try:
-            vector_store.add_documents(text_chunks)
-            logger.debug("Documents added to vector store")
-        except Exception as e:
-            # Log any errors that occur when adding to vector store
-            logger.error(f"Error adding to vector store: {str(e)}")
-            # Return 500 Internal Server Error if vector store update fails
-            return jsonify({'error': f'Error adding to vector store: {str(e)}'}), 500
+        jobs = []
+        for file in files:
+            # Log the file being queued
+            logger.debug(f"Queueing file: {file.filename}")
+            # Save the file now, while the request stream is still open
+            temp_path = save_upload(file)
+            # Ingest every file on its own worker so multi-file uploads run in parallel
+            job_id = job_queue.submit(ingest_document, temp_path, file.filename)
+            jobs.append({'job_id': job_id, 'filename': file.filename})
 
-        # Return success response with the number of chunks processed
+        # Return 202 Accepted - processing continues in the background
         return jsonify({
-            'message': 'File uploaded and processed successfully',
-            'chunks_processed': len(text_chunks)
-        })
+            'message': 'File(s) accepted for processing',
+            'jobs': jobs
+        }), 202
 
+    except RequestEntityTooLarge:
+        # Let oversized uploads reach the 413 handler instead of reporting a 500
+        raise
     except Exception as e:
         # Catch any unexpected errors not caught by specific handlers
         logger.error(f"Unexpected error: {str(e)}")
         # Return 500 Internal Server Error for unexpected failures
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
 
+# Return a JSON error when an upload exceeds MAX_CONTENT_LENGTH
+@app.errorhandler(413)
+def upload_too_large(e):
+    logger.warning("Upload rejected: request body too large")
+    # Return 413 Payload Too Large with the configured limit
+    return jsonify({'error': f'File too large - the limit is {Config.MAX_UPLOAD_MB} MB'}), 413
+
+# Define the API endpoint for checking the progress of a background ingestion job
+@app.route('/status/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Report the state of a background ingestion job.
+    
+    Returns:
+        JSON response with the job state (PENDING, STARTED, SUCCESS or FAILURE),
+        its result on success or its error on failure; 404 for unknown job ids
+    """
+    status = job_queue.status(job_id)
+    if status is None:
+        # Return 404 Not Found for unknown or expired job ids
+        return jsonify({'error': 'Unknown job id'}), 404
+    return jsonify(status)
+
 # Define the API endpoint for querying documents with natural language questions
 @app.route('/query', methods=['POST'])
 def query():
@@ -200,37 +372,83 @@ def query():
     Handle user queries against uploaded documents using semantic search and LLM.
     
     This endpoint:
-    1. Receives a natural language question from the user
+    1. Receives a natural language question (or a list of questions) from the user
     2. Searches the vector store for relevant document chunks
     3. Uses GPT-4 to generate an answer based on the retrieved documents
     
+    Accepts either {"question": "..."} or {"questions": ["...", "..."]},
+    with at most Config.MAX_BATCH_QUESTIONS questions per batch.
+    Batched questions share one embedding call and one vector store query.
+    An optional "session_id" keeps chat history separate for each conversation.
+    
     Returns:
-        JSON response with the LLM's answer or error details
+        JSON response with the LLM's answer(s) or error details
     """
-    # Get the JSON request data containing the user's question
+    # Get the JSON request data containing the user's question(s)
     data = request.json
-    # Validate that a question was provided
-    if 'question' not in data:
+    # Validate that a question or a list of questions was provided
+    if 'question' not in data and 'questions' not in data:
         # Return 400 Bad Request if no question is provided
         return jsonify({'error': 'No question provided'}), 400
 
+    # Conversation history is kept per session_id - without one, the question is answered standalone
+    session_id = data.get('session_id')
+
+    # Several questions can be sent at once as {"questions": [...]}
+    if 'questions' in data:
+        questions = data['questions']
+        # Validate that the batch is a non-empty list of strings
+        if not isinstance(questions, list) or not questions or \
+                not all(isinstance(question, str) for question in questions):
+            return jsonify({'error': 'questions must be a non-empty list of strings'}), 400
+        # Cap the batch so one request can't fan out into an unbounded number of LLM calls
+        if len(questions) > Config.MAX_BATCH_QUESTIONS:
+            return jsonify({'error': f'At most {Config.MAX_BATCH_QUESTIONS} questions can be sent at once'}), 400
+
+        try:
+            # Retrieve context for all questions in one round-trip and answer them in parallel
+            responses = llm_service.get_batch_response(session_id, questions)
+            # Return the responses in the same order as the questions
+            return jsonify({'responses': responses})
+        except Exception as e:
+            # Catch and return any errors that occur during query processing
+            return jsonify({'error': str(e)}), 500
+
     try:
         # Call the LLM service to generate a response
         # The service will:
         # 1. Convert the question to an embedding
         # 2. Search vector store for similar document chunks
         # 3. Use GPT-4 to generate an answer based on those chunks
-        response = llm_service.get_response(data['question'])
+        response = llm_service.get_response(session_id, data['question'])
         # Return the response as JSON
         return jsonify({'response': response})
     except Exception as e:
         # Catch and return any errors that occur during query processing
         return jsonify({'error': str(e)}), 500
 
+# Define the API endpoint for inspecting query cache effectiveness
+@app.route('/stats', methods=['GET'])
+def stats():
+    """
+    Report hit/miss statistics for the exact and semantic LLM answer caches.
+    
+    Returns:
+        JSON response with size, hits, misses and hit_rate for each cache
+    """
+    return jsonify(llm_service.cache_stats())
+
 # Main entry point - runs the Flask application
 if __name__ == '__main__':
-    # Start the Flask development server
     # host='0.0.0.0' makes the server accessible from any IP address (not just localhost)
     # port=8080 specifies the port number for the web server
-    # debug=True enables auto-reload on code changes and detailed error messages
-    app.run(host='0.0.0.0', port=8080, debug=True)
\ No newline at end of file
+    if Config.DEBUG:
+        # Start the Flask development server
+        # debug=True enables auto-reload on code changes and detailed error messages
+        app.run(host='0.0.0.0', port=8080, debug=True)
+    else:
+        # Serve with waitress - a production WSGI server that handles requests on a thread pool,
+        # so slow OpenAI and S3 calls in one request don't hold up the others
+        # A single process keeps the in-memory caches and background job registry shared by all requests
+        from waitress import serve
+        serve(app, host='0.0.0.0', port=8080, threads=Config.SERVER_THREADS)
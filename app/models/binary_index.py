@@ -0,0 +1,94 @@
+# Import threading to guard the in-memory code buffer shared between request threads
+import threading
+# Import numpy for bit packing and Hamming distances
+import numpy as np
+
+
+# Number of set bits for every possible byte value, used to popcount packed codes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+# Number of rows allocated for the code buffer on the first insert
+_INITIAL_CAPACITY = 1024
+
+
+# Helper function to find the indices of the k smallest values, unordered, in O(N) instead of a full sort
+def _smallest(values, k):
+    if k >= len(values):
+        return np.arange(len(values))
+    return np.argpartition(values, k)[:k]
+
+
+# Helper function to scale vectors to unit length along the last axis
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.clip(norms, 1e-12, None)
+
+
+# Define BinaryIndex class - an in-memory binary-quantized index used to preselect search candidates
+class BinaryIndex:
+    # Initialize an empty index
+    def __init__(self):
+        # Chunk ids, in the same order as the rows of the code buffer
+        self._ids = []
+        # 1 bit per dimension (sign of each component), packed 8 dimensions per byte
+        # Preallocated and grown by doubling, so inserts don't copy the whole index every time
+        self._bin = None
+        # Number of rows of the code buffer that are in use
+        self._size = 0
+        # Lock guarding the buffer - inserts and searches can run on different threads
+        self._lock = threading.RLock()
+
+    # Number of vectors stored in the index
+    def __len__(self):
+        return self._size
+
+    # Helper function to binary-encode vectors: 1 for positive components, 0 otherwise
+    @staticmethod
+    def _binary_encode(vectors):
+        return np.packbits(np.asarray(vectors) > 0, axis=-1)
+
+    # Method to add vectors and their chunk ids, keeping only the packed binary codes
+    def add(self, ids, vectors):
+        if not len(ids):
+            return
+        codes = self._binary_encode(vectors)
+        with self._lock:
+            needed = self._size + len(codes)
+            if self._bin is None:
+                self._bin = np.empty((max(_INITIAL_CAPACITY, needed), codes.shape[1]), dtype=np.uint8)
+            elif needed > len(self._bin):
+                # Double the capacity so the cost of copying is amortized over many inserts
+                grown = np.empty((max(2 * len(self._bin), needed), codes.shape[1]), dtype=np.uint8)
+                grown[:self._size] = self._bin[:self._size]
+                self._bin = grown
+            self._bin[self._size:needed] = codes
+            self._ids.extend(ids)
+            self._size = needed
+
+    # Method to drop the codes of the given chunk ids, e.g. when a failed upload is rolled back
+    def remove(self, ids):
+        drop = set(ids)
+        with self._lock:
+            keep = [i for i, chunk_id in enumerate(self._ids) if chunk_id not in drop]
+            if len(keep) == self._size:
+                return
+            # Copy the remaining rows into a new buffer - searches may still be reading the old one
+            self._bin = self._bin[keep] if keep else None
+            self._ids = [self._ids[i] for i in keep]
+            self._size = len(keep)
+
+    # Method to find the ids of the k vectors whose codes are closest to the query's, nearest first
+    def search(self, query_vector, k=16):
+        # Callers rerank these candidates with the full-precision vectors, so k should be
+        # a few times larger than the number of results they need
+        query_code = self._binary_encode(query_vector)
+        with self._lock:
+            if not self._size:
+                return []
+            # Rows below _size are never rewritten in place, so the slice stays valid after the lock is released
+            codes, ids = self._bin[:self._size], self._ids[:self._size]
+
+        # Popcount of the XOR of the packed codes is the number of differing sign bits
+        distances = _POPCOUNT[np.bitwise_xor(codes, query_code)].sum(axis=1, dtype=np.uint32)
+        candidates = _smallest(distances, k)
+        candidates = candidates[np.argsort(distances[candidates])]
+        return [ids[i] for i in candidates]
@@ -0,0 +1,124 @@
+# Import os to size the ONNX Runtime thread pool to the machine
+import os
+# Import numpy to mean-pool the ONNX model outputs
+import numpy as np
+# Import httpx to set an explicit timeout on Jina API calls
+import httpx
+# Import Embeddings - the LangChain interface expected by Chroma and VectorStore
+from langchain_core.embeddings import Embeddings
+# Import the shared HTTP client - thread-safe and pooled, so embed worker threads and request threads can share it
+from services.http_client import http_client
+
+
+# Jina embeddings endpoint
+JINA_API_URL = "https://api.jina.ai/v1/embeddings"
+# Maximum number of tokens Jina embeds in one long-context (late chunking) request
+JINA_MAX_TOKENS = 8192
+# Number of texts sent per request when embedding chunks independently
+JINA_BATCH_SIZE = 256
+# Timeout for Jina API calls - a stalled request fails instead of pinning an ingest worker forever
+# Long-context late chunking requests can take a while, so reads get 120s and connecting 10s
+JINA_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+
+# Define JinaLateChunkEmbeddings class - Jina v3 embeddings with support for late chunking
+class JinaLateChunkEmbeddings(Embeddings):
+    # Initialize the client with a Jina API key and the embedding model to use
+    def __init__(self, api_key, model="jina-embeddings-v3"):
+        # Model name - also used by VectorStore to name the collection and key the embedding cache
+        self.model = model
+        # Sent with every request through the shared connection pool
+        self._headers = {"Authorization": f"Bearer {api_key}"}
+
+    # Helper method to embed a list of texts for a given Jina task
+    def _embed(self, texts, task, late_chunking=False):
+        response = http_client.post(JINA_API_URL, headers=self._headers, timeout=JINA_TIMEOUT, json={
+            "model": self.model,
+            "task": task,
+            "late_chunking": late_chunking,
+            "input": texts
+        })
+        response.raise_for_status()
+        # Results carry their input position - sort so vectors line up with the texts
+        data = sorted(response.json()["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+    # Method to embed chunks independently, one vector per text
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), JINA_BATCH_SIZE):
+            vectors.extend(self._embed(texts[start:start + JINA_BATCH_SIZE], "retrieval.passage"))
+        return vectors
+
+    # Method to embed a search query
+    def embed_query(self, text):
+        return self._embed([text], "retrieval.query")[0]
+
+    # Method to embed several search queries, batched like embed_documents but with the query task
+    def embed_queries(self, texts):
+        vectors = []
+        for start in range(0, len(texts), JINA_BATCH_SIZE):
+            vectors.extend(self._embed(texts[start:start + JINA_BATCH_SIZE], "retrieval.query"))
+        return vectors
+
+    # Method to embed every chunk of a document in a single long-context pass
+    def embed_late_chunks(self, full_text, spans):
+        # With late_chunking Jina embeds the concatenated inputs as one document and pools
+        # one vector per input from the token embeddings, so each chunk keeps the document's context
+        # spans are non-overlapping (start, end) character offsets into full_text
+        return self._embed([full_text[start:end] for start, end in spans], "retrieval.passage", late_chunking=True)
+
+
+# Define OnnxEmbeddings class - local sentence-transformers embeddings on ONNX Runtime
+class OnnxEmbeddings(Embeddings):
+    # Initialize the model from the Hugging Face hub, e.g. an INT8-quantized ONNX export
+    # sentence-transformers repos keep their exports under onnx/: model.onnx (FP32),
+    # model_qint8_avx512.onnx and model_quint8_avx2.onnx (INT8, tuned for those CPU instruction sets)
+    def __init__(self, model_id="sentence-transformers/multi-qa-distilbert-cos-v1",
+                 file_name="model_qint8_avx512.onnx", batch_size=32):
+        # Optional dependencies, only needed when EMBEDDINGS_BACKEND=onnx
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        # Model name used by VectorStore for the collection name and embedding cache keys
+        # Chroma collection names can't contain "/", so drop the hub organisation
+        self.model = model_id.split("/")[-1]
+        # Number of texts tokenized and run through the model at once
+        self.batch_size = batch_size
+
+        # ONNX Runtime sizes its own thread pool from the session options, not from OMP_NUM_THREADS
+        # Use every core for intra-op parallelism
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = os.cpu_count()
+        self._tokenizer = AutoTokenizer.from_pretrained(model_id)
+        self._model = ORTModelForFeatureExtraction.from_pretrained(
+            model_id,
+            subfolder="onnx",
+            file_name=file_name,
+            provider="CPUExecutionProvider",
+            session_options=session_options
+        )
+
+    # Helper method to embed one batch: run the model and mean-pool token embeddings over the attention mask
+    def _embed_batch(self, texts):
+        inputs = self._tokenizer(texts, padding=True, truncation=True, return_tensors="np")
+        hidden = self._model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled.tolist()
+
+    # Method to embed chunks, one vector per text
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]))
+        return vectors
+
+    # Method to embed a search query
+    def embed_query(self, text):
+        return self._embed_batch([text])[0]
+
+    # Method to embed several search queries - the model embeds queries and passages the same way
+    def embed_queries(self, texts):
+        return self.embed_documents(texts)
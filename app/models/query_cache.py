@@ -0,0 +1,171 @@
+# Import hashlib to build compact, fixed-size cache keys from query strings
+import hashlib
+# Import time to timestamp cache entries for TTL expiration
+import time
+# Import threading so the cache can be shared safely between Flask worker threads
+import threading
+# Import numpy to compare query embeddings against cached ones in a single matrix product
+import numpy as np
+# Import OrderedDict to keep entries in recency order for LRU eviction
+from collections import OrderedDict
+
+
+# Helper function to build a cache key from a query and any extra parameters (e.g. k)
+def make_cache_key(query, *extra):
+    # Normalize the query so whitespace and casing differences hit the same entry
+    normalized = " ".join(query.split()).lower()
+    # Hash the normalized query so long questions don't bloat the cache keys
+    digest = hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+    return (digest,) + extra
+
+
+# Define QueryCache class - a thread-safe LRU cache with per-entry TTL expiration
+class QueryCache:
+    # Initialize the cache with a maximum number of entries and a time-to-live in seconds
+    def __init__(self, max_size=2000, ttl_seconds=300):
+        # Maximum number of entries kept before the least recently used one is evicted
+        self.max_size = max_size
+        # Number of seconds an entry stays valid after it was stored
+        self.ttl_seconds = ttl_seconds
+        # OrderedDict keeps keys ordered from least to most recently used
+        # Each value is stored as a (timestamp, value) tuple
+        self._entries = OrderedDict()
+        # RLock guards every access so concurrent requests don't corrupt the ordering
+        self._lock = threading.RLock()
+        # Counters used to report cache effectiveness via the /stats endpoint
+        self.hits = 0
+        self.misses = 0
+
+    # Method to look up a cached value, returning None on a miss or an expired entry
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            # Treat a missing key as a miss
+            if entry is None:
+                self.misses += 1
+                return None
+
+            timestamp, value = entry
+            # Drop entries that outlived their TTL and treat them as a miss
+            if time.time() - timestamp > self.ttl_seconds:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            # Move the entry to the most recently used position
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # Method to store a value in the cache, evicting the least recently used entries if needed
+    def put(self, key, value):
+        with self._lock:
+            # Store the value alongside the current time so it can expire later
+            self._entries[key] = (time.time(), value)
+            # Mark the entry as most recently used
+            self._entries.move_to_end(key)
+            # Evict from the least recently used end until we are back under the size limit
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    # Method to remove every entry, used when the underlying data changes
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # Method to report hit/miss counters for monitoring
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                # Avoid division by zero before the first lookup
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+
+# Define SemanticCache class - serves cached values for queries whose embeddings are near-duplicates
+class SemanticCache:
+    # Initialize the cache with a capacity, a cosine similarity threshold and a time-to-live in seconds
+    def __init__(self, max_size=256, threshold=0.98, ttl_seconds=300):
+        # Number of most recent entries that are compared against each query
+        self.max_size = max_size
+        # Minimum cosine similarity for a cached entry to count as a hit
+        self.threshold = threshold
+        # Number of seconds an entry stays valid after it was stored
+        self.ttl_seconds = ttl_seconds
+        # Unit-length float32 vectors, one row per slot; allocated on the first put
+        self._vectors = None
+        # Per-slot (timestamp, context, value) tuples, None for empty slots
+        self._entries = [None] * max_size
+        # Next slot to overwrite - the buffer is a ring, so the oldest entry is replaced first
+        self._next = 0
+        # Lock guarding the matrix and the slots
+        self._lock = threading.RLock()
+        # Counters used to report cache effectiveness via the /stats endpoint
+        self.hits = 0
+        self.misses = 0
+
+    # Helper function to scale a vector to unit length so a dot product equals cosine similarity
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    # Method to find a cached value whose vector is within the threshold and whose context matches
+    def get(self, vector, context=None):
+        with self._lock:
+            if self._vectors is None:
+                self.misses += 1
+                return None
+
+            # Cosine similarity against every slot in one matrix-vector product
+            scores = self._vectors @ self._normalize(vector)
+            now = time.time()
+            # Check candidates from most to least similar until one is valid
+            for slot in np.argsort(-scores):
+                if scores[slot] < self.threshold:
+                    break
+                entry = self._entries[slot]
+                if entry is None:
+                    continue
+                timestamp, entry_context, value = entry
+                if entry_context == context and now - timestamp <= self.ttl_seconds:
+                    self.hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    # Method to store a value under a query vector, replacing the oldest slot when full
+    def put(self, vector, value, context=None):
+        vector = self._normalize(vector)
+        with self._lock:
+            # Allocate the matrix once the embedding dimension is known
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            self._vectors[self._next] = vector
+            self._entries[self._next] = (time.time(), context, value)
+            self._next = (self._next + 1) % self.max_size
+
+    # Method to remove every entry
+    def clear(self):
+        with self._lock:
+            self._vectors = None
+            self._entries = [None] * self.max_size
+            self._next = 0
+
+    # Method to report hit/miss counters for monitoring
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': sum(entry is not None for entry in self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                # Avoid division by zero before the first lookup
+                'hit_rate': self.hits / total if total else 0.0
+            }
@@ -1,3 +1,21 @@
+# Import os to build the paths of the on-disk embedding cache and the normalization marker
+import os
+# Import hashlib to key cached embeddings by a hash of the chunk text
+import hashlib
+# Import uuid4 to generate unique ids for the chunks inserted into Chroma
+from uuid import uuid4
+# Import queue to hand parsed chunk batches from the parser thread to the embedder
+import queue
+# Import threading to parse documents on a background thread while their chunks are embedded
+import threading
+# Import ThreadPoolExecutor to overlap embedding requests with database inserts
+from concurrent.futures import ThreadPoolExecutor
+# Import deque to keep embedding requests in flight in submission order
+from collections import deque
+# Import numpy to store cached embedding vectors as compact float32 bytes
+import numpy as np
+# Import diskcache - a persistent key/value store used to cache embeddings across restarts
+import diskcache
 # Import chromadb - a vector database library for storing and retrieving embeddings
 # chromadb is lightweight, open-source, and designed for semantic search on embeddings
 import chromadb 
@@ -7,6 +25,37 @@ from langchain_chroma import Chroma
 # Import OpenAIEmbeddings to convert text into vector embeddings using OpenAI's models
 # Embeddings transform text into numerical vectors that capture semantic meaning
 from langchain_openai import OpenAIEmbeddings
+# Import JinaLateChunkEmbeddings for the optional Jina backend with late chunking
+from models.embeddings import JinaLateChunkEmbeddings, OnnxEmbeddings, JINA_MAX_TOKENS
+# Import Document to wrap raw Chroma query results in LangChain's document type
+from langchain_core.documents import Document
+# Import BinaryIndex for the in-memory binary-quantized search path
+from models.binary_index import BinaryIndex, normalize, _smallest
+# Import Config to check whether binary-quantized search is enabled
+from config import Config
+# Import the shared HTTP client so embedding calls reuse pooled keepalive connections
+from services.http_client import http_client
+
+
+# Number of chunks sent to the OpenAI embeddings endpoint per request
+EMBED_BATCH_SIZE = 256
+# Number of embedding requests allowed in flight at the same time
+EMBED_MAX_WORKERS = 4
+# Maximum number of vectors written to the vector database in a single call
+# Matches the 500-vector cap of S3 Vectors' PutVectors so both backends shard the same way
+INSERT_BATCH_SIZE = 500
+# Number of rows read from Chroma per request when loading the collection at startup
+LOAD_PAGE_SIZE = 5000
+# Number of parsed chunk batches allowed to wait for embedding - bounds memory while streaming
+STREAM_QUEUE_SIZE = 4
+# Number of binary-index candidates reranked with full-precision vectors per requested result
+BINARY_OVERSAMPLE = 4
+
+# HNSW index parameters applied when the collection is first created
+# M=32 links per node and construction_ef=200 build a denser graph: slower inserts, better recall
+# search_ef=128 visits more graph nodes per query than Chroma's default of 10, for higher recall
+# at a small latency cost - Chroma only reads it at creation, so it is fixed per collection
+HNSW_METADATA = {"hnsw:space": "cosine", "hnsw:construction_ef": 200, "hnsw:M": 32, "hnsw:search_ef": 128}
 
 
 # Define VectorStore class to manage document embeddings and similarity search
@@ -16,15 +65,51 @@ class VectorStore:
         # Create an OpenAIEmbeddings instance to convert documents to vector embeddings
         # This uses OpenAI's embedding models to represent text as numerical vectors
         # The embeddings capture semantic meaning, allowing similarity-based search
-        self.embeddings = OpenAIEmbeddings()
+        # model=Config.EMBEDDING_MODEL defaults to text-embedding-3-small, cheaper and better than ada-002
+        # The OpenAI SDK already requests base64-encoded vectors and decodes them, so responses stay compact
+        # http_client shares the process-wide connection pool with the chat model
+        # EMBEDDINGS_BACKEND="jina" switches to Jina v3, which can embed whole documents with late chunking
+        # EMBEDDINGS_BACKEND="onnx" runs a sentence-transformers model in-process, with no network round-trip
+        if Config.EMBEDDINGS_BACKEND == "jina":
+            self.embeddings = JinaLateChunkEmbeddings(api_key=Config.JINA_API_KEY)
+        elif Config.EMBEDDINGS_BACKEND == "onnx":
+            self.embeddings = OnnxEmbeddings(model_id=Config.ONNX_MODEL_ID, file_name=Config.ONNX_MODEL_FILE)
+        else:
+            self.embeddings = OpenAIEmbeddings(
+                model=Config.EMBEDDING_MODEL,
+                embedding_ctx_length=8191,
+                http_client=http_client
+            )
         # Initialize a Chroma vector store with persistent storage
         # persist_directory=path specifies where to save embeddings on disk for later retrieval
         # embedding_function=self.embeddings tells Chroma which embedding model to use
         # Chroma stores these embeddings in an efficient format optimized for similarity search
+        # collection_name keeps one collection per embedding model, since vectors from
+        # different models can't be compared - switching models requires re-uploading documents
         self.vectore_store = Chroma(
+            collection_name=self.embeddings.model,
             persist_directory=path,
-            embedding_function=self.embeddings
+            embedding_function=self.embeddings,
+            # Configure the approximate nearest neighbour (HNSW) index instead of Chroma's defaults
+            # Only takes effect for new collections - existing ones keep their original settings
+            collection_metadata=HNSW_METADATA
         )
+        # Optional in-memory binary-quantized copy of the collection (1 bit per dimension)
+        # Searches scan the compact codes and only rerank a few candidates with FP32 vectors from Chroma
+        self._binary_index = BinaryIndex() if Config.BINARY_INDEX else None
+        # Marker file recording that the collection's legacy vectors were already normalized
+        # Kept outside the collection metadata, which Chroma replaces as a whole on modify (HNSW settings included)
+        self._normalized_marker = os.path.join(path, f"{self.embeddings.model}.normalized")
+        # Normalize vectors stored before inserts were normalized (first boot only), and fill the binary index
+        self.load()
+        # Worker threads shared by every insert, so each upload doesn't start its own pool
+        self._executor = ThreadPoolExecutor(max_workers=EMBED_MAX_WORKERS, thread_name_prefix='embed')
+        # Persistent cache of chunk embeddings keyed by a hash of the chunk text
+        # Re-uploaded documents and repeated boilerplate are served from disk instead of OpenAI
+        self._emb_cache = diskcache.Cache(os.path.join(path, "emb_cache"))
+        # Callbacks run whenever documents are added, so caches built on top of search results
+        # (like LLMService's answer caches) are invalidated
+        self._invalidation_listeners = []
 
     
     # Method to add documents to the vector store
@@ -32,16 +117,298 @@ class VectorStore:
         # Convert documents to embeddings and store them in the vector database
         # This makes the documents searchable via semantic similarity search later
         # The documents parameter should be a list of LangChain Document objects
-        self.vectore_store.add_documents(documents)
+        self._add_batches([documents])
+
+    # Helper method to embed and insert chunks arriving in batches of any size
+    def _add_batches(self, batches):
+        # batches is an iterable of lists of LangChain Document objects
+        # Chunks are regrouped so each OpenAI request embeds exactly EMBED_BATCH_SIZE texts
+        # (except the last), however small the incoming batches are
+        # If anything fails, the chunks already written are deleted so no partial document stays searchable
+        # Returns the total number of chunks added
+        texts = []
+        metadatas = []
+        # (texts, metadatas, future) for embedding requests running on the shared executor, oldest first
+        in_flight = deque()
+        inserted = []
+        count = 0
+
+        # Helper function to start embedding a group of chunks on a worker thread
+        def submit(group_texts, group_metadatas):
+            future = self._executor.submit(self._embed_with_cache, group_texts)
+            in_flight.append((group_texts, group_metadatas, future))
+
+        # Helper function to write the oldest finished request to Chroma, keeping inserts in order
+        def insert_oldest():
+            group_texts, group_metadatas, future = in_flight.popleft()
+            inserted.extend(self._insert(group_texts, future.result(), group_metadatas))
+
+        try:
+            for batch in batches:
+                texts.extend(doc.page_content for doc in batch)
+                metadatas.extend(doc.metadata for doc in batch)
+                count += len(batch)
+                while len(texts) >= EMBED_BATCH_SIZE:
+                    submit(texts[:EMBED_BATCH_SIZE], metadatas[:EMBED_BATCH_SIZE])
+                    del texts[:EMBED_BATCH_SIZE]
+                    del metadatas[:EMBED_BATCH_SIZE]
+                    # Embed up to EMBED_MAX_WORKERS groups at once while this thread writes the oldest one
+                    if len(in_flight) >= EMBED_MAX_WORKERS:
+                        insert_oldest()
+            if texts:
+                submit(texts, metadatas)
+            while in_flight:
+                insert_oldest()
+        except BaseException:
+            # Requests that haven't started are dropped, running ones finish and are discarded
+            for _, _, future in in_flight:
+                future.cancel()
+            self._delete(inserted)
+            raise
+        finally:
+            # New documents can change the results of any query, so invalidate cached answers
+            self._invalidate()
+
+        return count
+
+    # Method to add a whole document whose chunks are given as character offsets
+    def add_documents_late(self, full_text, spans, metadatas):
+        # spans are non-overlapping (start, end) offsets into full_text, one per chunk
+        # metadatas holds one metadata dict per chunk
+        texts = [full_text[start:end] for start, end in spans]
+        # Late chunking needs an embeddings backend that supports it and a document that fits
+        # in a single long-context request (roughly 4 characters per token)
+        if not hasattr(self.embeddings, 'embed_late_chunks') or len(full_text) / 4 > JINA_MAX_TOKENS:
+            # Otherwise embed the chunks independently with the same backend
+            self.add_documents(self._to_documents(texts, metadatas))
+            return
+
+        # One request embeds the full document and returns one context-aware vector per chunk
+        # These vectors depend on the surrounding text, so they bypass the per-chunk embedding cache
+        self._insert(texts, self.embeddings.embed_late_chunks(full_text, spans), metadatas)
+        # New documents can change the results of any query, so invalidate cached answers
+        self._invalidate()
     
 
-    # Method to search for similar documents based on a query
-    def similarity_search(self, query, k=4):
-        # Convert the query to an embedding and find the k most similar documents
-        # k=4 is the default number of similar documents to return (can be overridden)
-        # This uses vector distance (e.g., cosine similarity) to find semantically related documents
-        # Returns a list of Document objects that are most similar to the query
-        return self.vectore_store.similarity_search(query, k=k)
+    # Method to read the stored embeddings at startup when there is work to do
+    def load(self):
+        # Vectors written before inserts were normalized are rescaled to unit length in place,
+        # so every stored vector can be compared with a plain dot product
+        # This only has to happen once per collection, which the marker file records
+        # The same pass fills the binary-quantized index when it is enabled
+        normalized = os.path.exists(self._normalized_marker)
+        if normalized and self._binary_index is None:
+            return
+
+        collection = self.vectore_store._collection
+        offset = 0
+        while True:
+            page = collection.get(include=['embeddings'], limit=LOAD_PAGE_SIZE, offset=offset)
+            if not len(page['ids']):
+                break
+            vectors = np.asarray(page['embeddings'], dtype=np.float32)
+            if not normalized:
+                norms = np.linalg.norm(vectors, axis=1)
+                legacy = np.flatnonzero(np.abs(norms - 1.0) > 1e-3)
+                if len(legacy):
+                    collection.update(
+                        ids=[page['ids'][i] for i in legacy],
+                        embeddings=normalize(vectors[legacy]).tolist()
+                    )
+            if self._binary_index is not None:
+                # Binary codes only keep the sign of each component, so they don't need unit-length vectors
+                self._binary_index.add(page['ids'], vectors)
+            offset += len(page['ids'])
+
+        if not normalized:
+            open(self._normalized_marker, "w").close()
+
+    # Method to add chunks as they are produced, overlapping parsing with embedding
+    def add_documents_stream(self, batches):
+        # batches is an iterable (usually a generator) yielding lists of LangChain Document objects
+        # It is consumed on a background thread and handed over through a bounded queue,
+        # so the document is parsed while earlier chunks are embedded and at most
+        # STREAM_QUEUE_SIZE batches are held in memory at once
+        # Returns the total number of chunks added
+        pending = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        # Marker put on the queue once the producer has finished, successfully or not
+        done = object()
+        # Set when the consumer gives up, so the producer stops parsing the rest of the document
+        stop = threading.Event()
+        errors = []
+
+        # Helper function to queue an item, waiting while the queue is full unless the consumer has stopped
+        def hand_over(item):
+            while not stop.is_set():
+                try:
+                    pending.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for batch in batches:
+                    if not hand_over(batch):
+                        return
+            # Hand parser errors to the consuming thread so the caller sees them
+            except Exception as e:
+                errors.append(e)
+            finally:
+                hand_over(done)
+
+        # Generator over the queued batches, re-raising parser errors so the inserted chunks are rolled back
+        def consume():
+            while True:
+                batch = pending.get()
+                if batch is done:
+                    if errors:
+                        raise errors[0]
+                    return
+                yield batch
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            return self._add_batches(consume())
+        finally:
+            # Stop the parser if embedding failed, and wait for it so the source file can be removed safely
+            stop.set()
+            producer.join()
+
+    # Helper method to write precomputed embeddings to Chroma in shards of at most INSERT_BATCH_SIZE
+    def _insert(self, texts, embeddings, metadatas):
+        ids = [uuid4().hex for _ in texts]
+        # Store unit-length vectors so search is a pure dot product with no norms to compute
+        vectors = normalize(np.asarray(embeddings, dtype=np.float32))
+        for i in range(0, len(texts), INSERT_BATCH_SIZE):
+            # Insert precomputed embeddings directly so Chroma doesn't embed the texts again
+            try:
+                self.vectore_store._collection.add(
+                    ids=ids[i:i + INSERT_BATCH_SIZE],
+                    embeddings=vectors[i:i + INSERT_BATCH_SIZE].tolist(),
+                    documents=texts[i:i + INSERT_BATCH_SIZE],
+                    metadatas=metadatas[i:i + INSERT_BATCH_SIZE]
+                )
+            # Remove the shards already written, so a failed insert leaves nothing behind
+            except BaseException:
+                for start in range(0, i, INSERT_BATCH_SIZE):
+                    self.vectore_store._collection.delete(ids=ids[start:start + INSERT_BATCH_SIZE])
+                raise
+        # Keep the binary-quantized index in sync with the collection
+        if self._binary_index is not None:
+            self._binary_index.add(ids, vectors)
+        return ids
+
+    # Helper method to remove chunks from Chroma and the binary-quantized index
+    def _delete(self, ids):
+        for i in range(0, len(ids), INSERT_BATCH_SIZE):
+            self.vectore_store._collection.delete(ids=ids[i:i + INSERT_BATCH_SIZE])
+        if self._binary_index is not None:
+            self._binary_index.remove(ids)
+
+    # Helper method to embed a batch of texts, only calling OpenAI for texts not seen before
+    def _embed_with_cache(self, texts):
+        # Key each text by the embedding model and a 16-byte hash of its content
+        keys = [
+            (self.embeddings.model, hashlib.blake2b(text.encode(), digest_size=16).digest())
+            for text in texts
+        ]
+        # Cached vectors are stored as raw float32 bytes
+        vectors = [self._emb_cache.get(key) for key in keys]
+        vectors = [None if raw is None else np.frombuffer(raw, dtype=np.float32) for raw in vectors]
+
+        # Only the cache misses are sent to the embeddings endpoint
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            fresh = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, fresh):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+                self._emb_cache.set(keys[i], vectors[i].tobytes())
+
+        return [vector.tolist() for vector in vectors]
+
+    # Helper method to wrap raw Chroma query results in LangChain Document objects
+    @staticmethod
+    def _to_documents(texts, metadatas):
+        return [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(texts, metadatas)
+        ]
+
+    # Method to convert a query into its embedding vector
+    def embed_query(self, query):
+        # Returns a float32 numpy array that can be reused for search and semantic caching
+        return np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+
+    # Helper method to query Chroma for the neighbours of one or more query embeddings
+    def _query(self, query_embeddings, k):
+        response = self.vectore_store._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=k,
+            include=['documents', 'metadatas']
+        )
+        return [
+            self._to_documents(documents, metadatas)
+            for documents, metadatas in zip(response['documents'], response['metadatas'])
+        ]
+
+    # Method to convert several queries into embedding vectors with one request
+    def embed_queries(self, queries):
+        # Backends with separate query and passage tasks (Jina) provide embed_queries
+        # OpenAI embeds queries and documents the same way, so embed_documents batches them
+        embed = getattr(self.embeddings, 'embed_queries', self.embeddings.embed_documents)
+        return np.asarray(embed(queries), dtype=np.float32)
+
+    # Helper method to search the binary-quantized index and rerank its candidates with the vectors stored in Chroma
+    def _binary_search(self, vector, k):
+        # Hamming distance on the binary codes picks BINARY_OVERSAMPLE * k candidates
+        ids = self._binary_index.search(vector, k=BINARY_OVERSAMPLE * k)
+        if not ids:
+            return []
+        # Only the candidates' full-precision vectors are read, so none are kept in memory
+        response = self.vectore_store._collection.get(
+            ids=ids,
+            include=['embeddings', 'documents', 'metadatas']
+        )
+        if not len(response['ids']):
+            return []
+        # Rerank by cosine similarity - a dot product since the stored vectors are unit length
+        scores = np.asarray(response['embeddings'], dtype=np.float32) @ np.asarray(vector, dtype=np.float32)
+        # Select the k best candidates in O(N) and only sort those k
+        top = _smallest(-scores, k)
+        top = top[np.argsort(-scores[top])]
+        return self._to_documents(
+            [response['documents'][i] for i in top],
+            [response['metadatas'][i] for i in top]
+        )
+
+    # Method to search for similar documents using an already computed query embedding
+    def similarity_search_by_vector(self, vector, k=4):
+        # Skips the embedding call, so callers that already embedded the query save a round-trip
+        # Uses the binary-quantized index when enabled, otherwise Chroma's HNSW index
+        # The query is normalized the same way as the stored vectors
+        vector = normalize(np.asarray(vector, dtype=np.float32))
+        if self._binary_index is not None and len(self._binary_index):
+            return self._binary_search(vector, k)
+        return self._query([vector.tolist()], k)[0]
 
+    # Method to search for similar documents for several already computed query embeddings
+    def similarity_search_by_vectors(self, vectors, k=4):
+        # Returns one list of Document objects per vector, in the same order as the vectors
+        vectors = normalize(np.asarray(vectors, dtype=np.float32))
+        if self._binary_index is not None and len(self._binary_index):
+            # Scan the binary-quantized index once per query vector
+            return [self._binary_search(vector, k) for vector in vectors]
+        # Ask Chroma for the neighbours of all query vectors in a single call
+        return self._query(vectors.tolist(), k)
 
+    # Method to register a callback that runs every time documents are added
+    def add_invalidation_listener(self, callback):
+        self._invalidation_listeners.append(callback)
 
+    # Helper method to notify every registered listener that search results may have changed
+    def _invalidate(self):
+        for callback in self._invalidation_listeners:
+            callback()
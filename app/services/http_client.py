@@ -0,0 +1,13 @@
+# Import httpx - the HTTP client used by the OpenAI SDK under the hood
+import httpx
+
+
+# Shared HTTP client for every OpenAI call (chat completions and embeddings) and Jina embeddings call
+# One connection pool per process keeps TLS connections alive across requests,
+# and HTTP/2 multiplexes concurrent calls over the same connection
+# The 600s read timeout matches the OpenAI SDK default, connecting is capped at 10s
+http_client = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    timeout=httpx.Timeout(600.0, connect=10.0)
+)
@@ -0,0 +1,67 @@
+# Import uuid4 to generate unique job ids
+from uuid import uuid4
+# Import threading to guard the job registry shared between Flask and worker threads
+import threading
+# Import OrderedDict to keep jobs in submission order so the oldest can be pruned
+from collections import OrderedDict
+# Import ThreadPoolExecutor to run ingestion jobs in the background
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Job states reported by the /status endpoint
+PENDING = 'PENDING'
+STARTED = 'STARTED'
+SUCCESS = 'SUCCESS'
+FAILURE = 'FAILURE'
+
+
+# Define JobQueue class to run long tasks (like document ingestion) off the request thread
+class JobQueue:
+    # Initialize the queue with a fixed number of worker threads
+    def __init__(self, max_workers=2, max_jobs=1000):
+        # Worker threads that execute submitted jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingest')
+        # Registry of job records keyed by job id, oldest first
+        self._jobs = OrderedDict()
+        # Maximum number of job records kept for status lookups
+        self._max_jobs = max_jobs
+        # Lock guarding the job registry
+        self._lock = threading.Lock()
+
+    # Method to schedule a function in the background and return its job id immediately
+    def submit(self, func, *args, **kwargs):
+        job_id = uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {'state': PENDING, 'result': None, 'error': None}
+            # Forget the oldest finished jobs once the registry grows past its limit
+            while len(self._jobs) > self._max_jobs:
+                oldest_id = next(iter(self._jobs))
+                if self._jobs[oldest_id]['state'] in (PENDING, STARTED):
+                    break
+                del self._jobs[oldest_id]
+
+        self._executor.submit(self._run, job_id, func, *args, **kwargs)
+        return job_id
+
+    # Helper method executed on a worker thread to run a job and record its outcome
+    def _run(self, job_id, func, *args, **kwargs):
+        self._update(job_id, state=STARTED)
+        try:
+            result = func(*args, **kwargs)
+            self._update(job_id, state=SUCCESS, result=result)
+        # Record any failure so it can be reported through the status endpoint
+        except Exception as e:
+            print(f"Error running job {job_id}: {e}")
+            self._update(job_id, state=FAILURE, error=str(e))
+
+    # Helper method to update a job record under the lock
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    # Method to look up the state of a job, returning None for unknown job ids
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job, job_id=job_id) if job is not None else None
@@ -1,9 +1,35 @@
+# Import string for the precompiled prompt template
+import string
+# Import threading to serialize updates to a session's chat history
+import threading
+# Import hashlib to fold the rendered chat history into the answer cache keys
+import hashlib
 # Import ChatOpenAI to interact with OpenAI's GPT models via LangChain
 from langchain_openai import ChatOpenAI
 # Import BaseMessage types for handling chat messages
 from langchain_core.messages import HumanMessage, AIMessage
 # Import Config to access environment variables like API keys securely
 from config import Config
+# Import the shared HTTP client so OpenAI calls reuse pooled keepalive connections
+from services.http_client import http_client
+# Import QueryCache to memoize LLM answers for repeated questions
+from models.query_cache import QueryCache, SemanticCache, make_cache_key
+
+
+# Prompt template parsed once at import time and filled in for every question
+_PROMPT = string.Template("""
+You are a helpful AI assistant. Use the following context from documents to answer the user's question.
+If the context doesn't contain relevant information, say so honestly.
+
+Context:
+$context
+
+Chat History:
+$history
+
+Question: $question
+
+Answer:""")
 
 # Define LLMService class to encapsulate all LLM-related operations
 class LLMService:
@@ -13,50 +39,122 @@ class LLMService:
         # temperature=0.7 controls creativity (0=deterministic, 1=random), 0.7 is balanced
         # model_name="gpt-4-0613" specifies the GPT-4 model version to use
         # openai_api_key is retrieved from Config to authenticate with OpenAI API
+        # http_client reuses the process-wide connection pool instead of a client per instance
         self.llm = ChatOpenAI(
             temperature=0.7,
             model_name="gpt-4-0613",
-            openai_api_key=Config.OPENAI_API_KEY
+            openai_api_key=Config.OPENAI_API_KEY,
+            http_client=http_client
         )
         
         # Store the vector store for document retrieval
         self.vector_store = vector_store
         
-        # Store conversation history as a list of messages for context
-        # This allows the LLM to maintain conversation context across multiple queries
-        self.chat_history = []
+        # Store conversation history per session so users don't see each other's conversations
+        # Each entry is a (messages, rendered history string) tuple keyed by session id
+        # Sessions expire after an hour without a new question
+        self._sessions = QueryCache(max_size=10000, ttl_seconds=3600)
+        # Lock serializing read-modify-write updates of a session's history
+        self._sessions_lock = threading.Lock()
 
-    # Method to get a response from the LLM based on a user query
-    def get_response(self, query):
-        # Wrap the logic in a try-except block to handle errors gracefully
-        try:
-            # Search the vector store for relevant document chunks
-            # This retrieves the k=4 most similar documents to the query
-            relevant_docs = self.vector_store.similarity_search(query, k=4)
-            
-            # Extract the content from the retrieved documents to use as context
-            context = "\n".join([doc.page_content for doc in relevant_docs])
-            
-            # Build the conversation history as a string for inclusion in the prompt
-            chat_history_str = "\n".join([
+        # Only the last _MAX_TURNS question/answer pairs are kept and sent to the LLM
+        # This caps the prompt size instead of letting it grow with every query
+        self._MAX_TURNS = 8
+
+        # Cache generated answers so a repeated question skips the OpenAI chat round-trip
+        # Keys include the whole retained chat history because it is part of the prompt
+        self._response_cache = QueryCache(max_size=2000, ttl_seconds=300)
+        # Cache answers by query embedding so near-duplicate questions (cosine > 0.98) skip the LLM
+        self._semantic_cache = SemanticCache(max_size=256, threshold=0.98, ttl_seconds=300)
+
+        # Maximum number of chat completions running in parallel for batched questions
+        self._batch_concurrency = 4
+
+        # Cached answers depend on the retrieved documents, so drop them whenever documents are added
+        self.vector_store.add_invalidation_listener(self._clear_caches)
+
+    # Helper method to drop every cached answer
+    def _clear_caches(self):
+        self._response_cache.clear()
+        self._semantic_cache.clear()
+
+    # Method to report cache statistics for the exact and semantic answer caches
+    def cache_stats(self):
+        return {
+            'response': self._response_cache.stats(),
+            'semantic': self._semantic_cache.stats()
+        }
+
+    # Helper method to fetch a session's (messages, rendered history string), empty for new sessions
+    def _get_history(self, session_id):
+        if session_id is None:
+            return (), ""
+        return self._sessions.get(session_id) or ((), "")
+
+    # Helper method to build the response cache key from the query and the chat history
+    def _response_cache_key(self, query, history_str):
+        # Hash the whole rendered history - exactly what the prompt contains - so sessions
+        # that only share their latest turns never share answers
+        history_hash = hashlib.blake2b(history_str.encode(), digest_size=16).hexdigest()
+        return make_cache_key(query, history_hash)
+
+    # Helper method to build the LLM prompt from the retrieved documents and the chat history
+    def _build_prompt(self, query, relevant_docs, history_str):
+        # Extract the content from the retrieved documents to use as context
+        context = "\n".join(doc.page_content for doc in relevant_docs)
+        # Fill the precompiled template - history_str is the session's cached rendering
+        return _PROMPT.substitute(context=context, history=history_str, question=query)
+
+    # Helper method to record a question/answer pair in a session's bounded chat history
+    def _append_turn(self, session_id, query, response_text):
+        # Requests without a session id are answered without keeping any history
+        if session_id is None:
+            return
+        with self._sessions_lock:
+            messages, _ = self._get_history(session_id)
+            # Add the user query and assistant response to chat history
+            # This maintains conversation context for future queries
+            messages = messages + (HumanMessage(content=query), AIMessage(content=response_text))
+            # Drop the oldest turns once the history exceeds _MAX_TURNS pairs
+            messages = messages[-2 * self._MAX_TURNS:]
+            # Re-render the history string once here instead of on every prompt
+            history_str = "\n".join([
                 f"User: {msg.content}" if isinstance(msg, HumanMessage) else f"Assistant: {msg.content}"
-                for msg in self.chat_history
+                for msg in messages
             ])
-            
-            # Create the prompt for the LLM that includes context and conversation history
-            prompt_text = f"""
-You are a helpful AI assistant. Use the following context from documents to answer the user's question.
-If the context doesn't contain relevant information, say so honestly.
+            # Storing the session again also restarts its expiry timer
+            self._sessions.put(session_id, (messages, history_str))
 
-Context:
-{context}
+    # Method to get a response from the LLM based on a user query within a chat session
+    def get_response(self, session_id, query):
+        # Wrap the logic in a try-except block to handle errors gracefully
+        try:
+            # Load the conversation history of this session only
+            _, history_str = self._get_history(session_id)
 
-Chat History:
-{chat_history_str}
+            # Serve the answer from the cache when the same question was asked in the same context
+            cache_key = self._response_cache_key(query, history_str)
+            cached_response = self._response_cache.get(cache_key)
+            if cached_response is not None:
+                # Still record the turn so the conversation history stays consistent
+                self._append_turn(session_id, query, cached_response)
+                return cached_response.strip()
 
-Question: {query}
+            # Embed the query once - the vector serves both the semantic cache and the search
+            query_vector = self.vector_store.embed_query(query)
+            # Reuse the answer of a near-duplicate question asked in the same context
+            # The exact-match key's history part makes sure the context matches
+            cached_response = self._semantic_cache.get(query_vector, context=cache_key[1:])
+            if cached_response is not None:
+                self._append_turn(session_id, query, cached_response)
+                return cached_response.strip()
 
-Answer:"""
+            # Search the vector store for relevant document chunks
+            # This retrieves the k=4 most similar documents to the query without re-embedding it
+            relevant_docs = self.vector_store.similarity_search_by_vector(query_vector, k=4)
+            
+            # Create the prompt for the LLM that includes context and conversation history
+            prompt_text = self._build_prompt(query, relevant_docs, history_str)
             
             # Call the LLM with the prompt
             # The LLM returns a response based on the context and chat history
@@ -66,10 +164,12 @@ Answer:"""
             # The invoke method returns a message object, so we need to access its content
             response_text = response.content if hasattr(response, 'content') else str(response)
             
-            # Add the user query and assistant response to chat history
-            # This maintains conversation context for future queries
-            self.chat_history.append(HumanMessage(content=query))
-            self.chat_history.append(AIMessage(content=response_text))
+            # Record the turn so it is included in the context of future queries
+            self._append_turn(session_id, query, response_text)
+
+            # Remember the answer for repeated questions asked in the same context
+            self._response_cache.put(cache_key, response_text)
+            self._semantic_cache.put(query_vector, response_text, context=cache_key[1:])
             
             # Return the LLM's generated response
             return response_text.strip()
@@ -78,4 +178,73 @@ Answer:"""
             # Log the error message for debugging purposes
             print(f"Error getting LLM response: {e}")
             # Return a user-friendly error message instead of crashing the application
-            return "I encountered an error processing your request."
\ No newline at end of file
+            return "I encountered an error processing your request."
+
+    # Method to answer several questions at once with batched retrieval and parallel LLM calls
+    def get_batch_response(self, session_id, queries):
+        # Wrap the logic in a try-except block to handle errors gracefully
+        try:
+            # Every question in the batch sees the same conversation history
+            _, history_str = self._get_history(session_id)
+            cache_keys = [self._response_cache_key(query, history_str) for query in queries]
+            responses = [self._response_cache.get(key) for key in cache_keys]
+            # Only questions without a cached answer need retrieval and an LLM call
+            pending = [i for i, response in enumerate(responses) if response is None]
+            # (index, query vector) of the questions that still need retrieval and an LLM call
+            remaining = []
+
+            if pending:
+                # Embed all pending questions with one request - the vectors serve both the semantic cache and the search
+                vectors = self.vector_store.embed_queries([queries[i] for i in pending])
+                # Reuse the answers of near-duplicate questions asked in the same context, as get_response does
+                for i, vector in zip(pending, vectors):
+                    responses[i] = self._semantic_cache.get(vector, context=cache_keys[i][1:])
+                    if responses[i] is None:
+                        remaining.append((i, vector))
+
+            if remaining:
+                # Retrieve context for the remaining questions with a single vector store query
+                docs_per_query = self.vector_store.similarity_search_by_vectors(
+                    [vector for _, vector in remaining], k=4
+                )
+                prompts = [
+                    self._build_prompt(queries[i], relevant_docs, history_str)
+                    for (i, _), relevant_docs in zip(remaining, docs_per_query)
+                ]
+
+                # Run the chat completions concurrently on LangChain's thread pool
+                # max_concurrency caps the number of in-flight OpenAI requests
+                # return_exceptions keeps one failed completion from failing the whole batch
+                results = self.llm.batch(
+                    prompts,
+                    config={'max_concurrency': self._batch_concurrency},
+                    return_exceptions=True
+                )
+
+                for (i, vector), result in zip(remaining, results):
+                    # Failed questions stay None so they are neither cached nor added to the history
+                    if isinstance(result, Exception):
+                        print(f"Error getting LLM response: {result}")
+                        continue
+                    responses[i] = result.content if hasattr(result, 'content') else str(result)
+                    # Remember the answer for repeated questions asked in the same context
+                    self._response_cache.put(cache_keys[i], responses[i])
+                    self._semantic_cache.put(vector, responses[i], context=cache_keys[i][1:])
+
+            # Record the answered turns in the chat history in the order the questions were asked
+            for query, response_text in zip(queries, responses):
+                if response_text is not None:
+                    self._append_turn(session_id, query, response_text)
+
+            # Return the generated responses in the same order as the questions
+            return [
+                response_text.strip() if response_text is not None
+                else "I encountered an error processing your request."
+                for response_text in responses
+            ]
+        # Catch any exceptions that occur during processing (API errors, retrieval errors, etc.)
+        except Exception as e:
+            # Log the error message for debugging purposes
+            print(f"Error getting batch LLM response: {e}")
+            # Return a user-friendly error message for every question instead of crashing
+            return ["I encountered an error processing your request."] * len(queries)
@@ -2,9 +2,28 @@
 import boto3 
 # Import ClientError exception handler for AWS-specific errors
 from botocore.exceptions import ClientError 
+# Import BotoConfig to tune the connection pool and retry behaviour of the AWS clients
+from botocore.config import Config as BotoConfig
+# Import TransferConfig to tune multipart uploads for large documents
+from boto3.s3.transfer import TransferConfig
+# Import S3UploadFailedError - the managed transfer raises it instead of ClientError when an upload fails
+from boto3.exceptions import S3UploadFailedError
 # Import Config to access AWS credentials and bucket name from environment variables
 from config import Config 
 
+
+# Maximum number of vectors accepted by a single S3 Vectors PutVectors request
+PUT_VECTORS_BATCH_SIZE = 500
+
+# Client configuration shared by the S3 and S3 Vectors clients
+# A larger pool covers the parallel multipart upload threads, keepalive avoids TLS reconnects,
+# and adaptive retries back off automatically when AWS throttles requests
+_BOTO_CONFIG = BotoConfig(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "total_max_attempts": 5}
+)
+
 # Define S3Storage class to encapsulate all S3 storage operations
 class S3Storage:
     # Initialize S3Storage by creating a connection to AWS S3
@@ -15,33 +34,95 @@ class S3Storage:
         self.s3 = boto3.client(
             's3',
             aws_access_key_id=Config.AWS_ACCESS_KEY,
-            aws_secret_access_key=Config.AWS_SECRET_KEY
+            aws_secret_access_key=Config.AWS_SECRET_KEY,
+            config=_BOTO_CONFIG
         )
 
         # Store the S3 bucket name from Config for use in upload/download operations
         # This bucket is where all files will be stored and retrieved from
         self.bucket = Config.AWS_BUCKET_NAME
 
+        # Optional S3 Vectors bucket and index for deployments that store embeddings on S3
+        # The s3vectors client is only created when a vector bucket is configured
+        self.vector_bucket = Config.AWS_VECTOR_BUCKET_NAME
+        self.vector_index = Config.AWS_VECTOR_INDEX_NAME
+        self.s3vectors = boto3.client(
+            's3vectors',
+            aws_access_key_id=Config.AWS_ACCESS_KEY,
+            aws_secret_access_key=Config.AWS_SECRET_KEY,
+            config=_BOTO_CONFIG
+        ) if self.vector_bucket else None
+
+        # Upload files larger than 8 MB as multipart uploads with up to 8 parts in flight
+        # Parallel parts overlap several TCP streams instead of sending the body serially
+        self._tc = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=8,
+            use_threads=True
+        )
     
 
-    # Method to upload a file to S3 bucket
-    def upload_file(self, file_obj, filename):
+    # Method to upload a local file to S3 bucket
+    def upload_file(self, path, filename):
         # Wrap the upload logic in a try-except block to handle errors gracefully
         try: 
-            # Use boto3's upload_fileobj to upload a file object directly to S3
-            # file_obj is the file content (from request), filename is the destination name
+            # Use boto3's upload_file to upload straight from the local path
+            # path is the saved document on disk, filename is the destination name
             # self.bucket specifies which S3 bucket to upload to
-            self.s3.upload_fileobj(file_obj, self.bucket, filename)
+            # Config=self._tc enables threaded multipart uploads for large files
+            self.s3.upload_file(Filename=path, Bucket=self.bucket, Key=filename, Config=self._tc)
             # Return True to indicate successful upload
             return True
         # Catch AWS-specific errors that may occur during upload (permission denied, bucket not found, etc.)
-        except ClientError as e:
+        # upload_file wraps the underlying ClientError in S3UploadFailedError
+        except (ClientError, S3UploadFailedError) as e:
             # Log the error details for debugging
             print(f"Error uploading file: {e}")
             # Return False to indicate the upload failed
             return False
         
     
+    # Method to delete a file from S3 bucket, e.g. the archive of a document whose ingestion failed
+    def delete_file(self, filename):
+        # Wrap the delete logic in a try-except block to handle errors gracefully
+        try:
+            self.s3.delete_object(Bucket=self.bucket, Key=filename)
+            # Return True to indicate the file was deleted
+            return True
+        # Catch AWS-specific errors (permission denied, bucket not found, etc.)
+        except ClientError as e:
+            # Log the error details for debugging
+            print(f"Error deleting file: {e}")
+            # Return False to indicate the delete failed
+            return False
+
+    # Method to write vectors to the configured S3 Vectors index
+    def put_vectors(self, vectors):
+        # vectors is a list of {'key': ..., 'data': {'float32': [...]}, 'metadata': {...}} dicts
+        # Return False when no vector bucket is configured
+        if self.s3vectors is None:
+            print("Error putting vectors: no S3 vector bucket configured")
+            return False
+
+        # Wrap the write logic in a try-except block to handle errors gracefully
+        try:
+            # PutVectors rejects bodies with more than 500 vectors, so write in shards
+            for i in range(0, len(vectors), PUT_VECTORS_BATCH_SIZE):
+                self.s3vectors.put_vectors(
+                    vectorBucketName=self.vector_bucket,
+                    indexName=self.vector_index,
+                    vectors=vectors[i:i + PUT_VECTORS_BATCH_SIZE]
+                )
+            # Return True to indicate every shard was written
+            return True
+        # Catch AWS-specific errors (index not found, permission denied, etc.)
+        except ClientError as e:
+            # Log the error details for debugging
+            print(f"Error putting vectors: {e}")
+            # Return False to indicate the write failed
+            return False
+
     # Method to retrieve a file from S3 bucket
     def get_file(self, filename):
         # Wrap the retrieval logic in a try-except block to handle errors gracefully